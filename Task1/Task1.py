@@ -1,150 +1,276 @@
-import math
+import heapq
+import os
 import time
-from create_rtree import main as build_rtree, RTree, Node
+import numpy as np
+from numba import njit, prange
+from scipy.spatial import cKDTree
+from create_rtree import bulk_load, RTree, Node
 
-# Function to calculate Euclidean distance between two points
-def euclidean_distance(p1, p2):
-    # Calculate the Euclidean distance using the formula: sqrt((x2 - x1)^2 + (y2 - y1)^2)
-    return math.sqrt((p1['x'] - p2['x']) ** 2 + (p1['y'] - p2['y']) ** 2)
+# Larger than any squared distance, used as the starting "best so far" (fastmath assumes no infinities)
+FAR = np.finfo(np.float64).max
+
+# Function to calculate the squared Euclidean distance between two points. The square root is left out because
+# it does not change which of two distances is smaller, and only comparisons are needed to find the nearest point.
+def sq_dist(p1, p2):
+    dx = p1['x'] - p2['x']
+    dy = p1['y'] - p2['y']
+    return dx * dx + dy * dy
 
 # Sequential Scan Based Method to find nearest neighbor
 def sequential_scan(query, data):
-    # Initialize the variables for tracking the nearest facility
-    nearest_facility = None
-    min_distance = float('inf')  # Set initial min_distance to infinity
-    
-    # Loop through all data points (facilities) to find the nearest one
-    for facility in data:
-        # Calculate the distance between the query point and the facility
-        distance = euclidean_distance(query, facility)
-        if distance < min_distance:
-            # Update the nearest facility and the minimum distance
-            min_distance = distance
-            nearest_facility = facility
-            
-    return nearest_facility
+    # Squared distance from the query to every facility in one vectorized pass.
+    # The square root is skipped because it does not change which facility is closest.
+    dx = data['x'] - query['x']
+    dy = data['y'] - query['y']
+    i = int(np.argmin(dx * dx + dy * dy))
+    return {'id': int(data['id'][i]), 'x': float(data['x'][i]), 'y': float(data['y'][i])}
+
+# Sequential Scan for all queries at once: builds the query-by-facility squared distance matrix with
+# broadcasting and takes the argmin of each row. Queries are processed in blocks so that each block of
+# the matrix holds at most block_size values instead of materialising all |Q| x |N| distances.
+def batch_sequential_scan(queries, data, block_size=1 << 22):
+    fx = data['x'][None, :]
+    fy = data['y'][None, :]
+    rows = max(1, block_size // len(data['x']))
+    nearest = np.empty(len(queries['x']), dtype=np.int64)
+    for start in range(0, len(nearest), rows):
+        qx = queries['x'][start:start + rows, None]
+        qy = queries['y'][start:start + rows, None]
+        d2 = (qx - fx) ** 2 + (qy - fy) ** 2
+        nearest[start:start + rows] = d2.argmin(axis=1)
+    return nearest  # Indices into the facility arrays
+
+# Reference nearest neighbor search with SciPy's cKDTree, which answers all queries in compiled code on every
+# CPU core. It is used to check the results of the other methods. Returns indices into the facility arrays.
+def kdtree_search(queries, data):
+    tree = cKDTree(np.column_stack([data['x'], data['y']]))
+    _, nearest = tree.query(np.column_stack([queries['x'], queries['y']]), k=1, workers=-1)
+    return nearest
+
+# Squared minimum distance (MINDIST) from the point (qx, qy) to an MBR given as [x1, y1, x2, y2].
+# At most one of x1 - qx and qx - x2 is positive and 0.0 covers a point inside the x range, so no branches are needed.
+def mbr_mindist2(mbr, qx, qy):
+    dx = max(mbr[0] - qx, qx - mbr[2], 0.0)
+    dy = max(mbr[1] - qy, qy - mbr[3], 0.0)
+    return dx * dx + dy * dy
 
 # Best First (BF) Algorithm using R-tree to find the nearest neighbor
 def best_first_search(query, rtree):
-    # Initialize variables to track the nearest neighbor and minimum distance
+    qx, qy = query['x'], query['y']
+    # Initialize variables to track the nearest neighbor and its squared distance
     nearest = None
-    min_distance = float('inf')
-    
-    # Use a stack to traverse the R-tree (initially contains the root node)
-    stack = [rtree.root]
-    
-    while stack:
-        node = stack.pop()
-        
+    min_sq = float('inf')
+
+    # Priority queue of nodes keyed by the squared minimum distance (MINDIST) from the query to their MBR.
+    # The id() of the node breaks ties so that Node objects are never compared.
+    heap = [(0.0, id(rtree.root), rtree.root)]
+
+    while heap:
+        node_sq, _, node = heapq.heappop(heap)
+        # Every remaining node is at least this far away, so none of them can hold a closer point
+        if node_sq >= min_sq:
+            break
+
         # If the node is a leaf, check its data points for the nearest neighbor
         if node.is_leaf():
             for point in node.data_points:
-                # Calculate the distance between the query and the point
-                distance = euclidean_distance(query, point)
-                if distance < min_distance:
+                distance_sq = sq_dist(query, point)
+                if distance_sq < min_sq:
                     # Update the nearest point if the current one is closer
-                    min_distance = distance
+                    min_sq = distance_sq
                     nearest = point
         else:
-            # For non-leaf nodes, sort the child nodes based on the distance to the query's MBR (Minimum Bounding Rectangle)
-            sorted_children = sorted(node.child_nodes, key=lambda child: euclidean_distance(query, {
-                'x': (child.MBR['x1'] + child.MBR['x2']) / 2,
-                'y': (child.MBR['y1'] + child.MBR['y2']) / 2
-            }))
-            # Add sorted children to the stack for further exploration
-            stack.extend(sorted_children)
-    
+            # For non-leaf nodes, queue the children whose MBR may still contain a closer point
+            for child in node.child_nodes:
+                child_sq = mbr_mindist2(child.MBR, qx, qy)
+                if child_sq < min_sq:
+                    heapq.heappush(heap, (child_sq, id(child), child))
+
     return nearest
 
-# Best First with Divide-and-Conquer using two R-trees
-def divide_and_conquer_search(left_rtree, right_rtree, query):
-    # Perform best first search on the left R-tree and right R-tree separately
-    left_nearest = best_first_search(query, left_rtree)
-    right_nearest = best_first_search(query, right_rtree)
-    
-    # Calculate the Euclidean distance to the query for both results
-    left_distance = euclidean_distance(query, left_nearest)
-    right_distance = euclidean_distance(query, right_nearest)
+# Squared minimum distance (MINDIST) from the point (qx, qy) to row c of an MBR array. At most one of x1 - qx and
+# qx - x2 is positive, and 0.0 covers a query inside the x range, so a single max() replaces the if/elif cases and
+# compiles to branch-free min/max instructions; likewise for y.
+@njit(fastmath=True, cache=True, inline='always')
+def point_mbr_dist2(qx, qy, mbr, c):
+    dx = max(mbr[c, 0] - qx, qx - mbr[c, 2], 0.0)
+    dy = max(mbr[c, 1] - qy, qy - mbr[c, 3], 0.0)
+    return dx * dx + dy * dy
+
+# Best First search over a flattened R-tree (see create_rtree.flatten), compiled with Numba. The search reads the
+# arena arrays directly, and each MBR is a single row of four contiguous values.
+# Nodes wait on a stack together with the squared minimum distance from the query to their MBR; a node is
+# skipped as soon as that distance is no smaller than the best squared distance found so far. Children are
+# pushed farthest first, so the closest child is always expanded next. Returns the index of the nearest point.
+@njit(fastmath=True, cache=True)
+def flat_nearest(qx, qy, mbr, child_start, child_count, leaf_start, leaf_count, pts_x, pts_y, stack_size):
+    stack = np.empty(stack_size, dtype=np.int32)
+    stack_d2 = np.empty(stack_size, dtype=np.float64)
+    stack[0] = 0  # Start from the root
+    stack_d2[0] = 0.0
+    top = 1
+    best_sq = FAR
+    best_idx = -1
+
+    while top > 0:
+        top -= 1
+        node = stack[top]
+        if stack_d2[top] >= best_sq:
+            continue  # Nothing inside this MBR can beat the current nearest point
+
+        if child_count[node] == 0:
+            # Leaf node: check each of its data points
+            for j in range(leaf_start[node], leaf_start[node] + leaf_count[node]):
+                dx = pts_x[j] - qx
+                dy = pts_y[j] - qy
+                d2 = dx * dx + dy * dy
+                if d2 < best_sq:
+                    best_sq = d2
+                    best_idx = j
+        else:
+            # Internal node: push the children that may still hold a closer point
+            first = top
+            for c in range(child_start[node], child_start[node] + child_count[node]):
+                d2 = point_mbr_dist2(qx, qy, mbr, c)
+                if d2 < best_sq:
+                    # Insertion sort keeps the pushed children in decreasing distance order
+                    k = top
+                    while k > first and stack_d2[k - 1] < d2:
+                        stack[k] = stack[k - 1]
+                        stack_d2[k] = stack_d2[k - 1]
+                        k -= 1
+                    stack[k] = c
+                    stack_d2[k] = d2
+                    top += 1
+
+    return best_idx
+
+# Find the nearest neighbor of a query in a flattened R-tree and return its position in the point arrays
+def flat_best_first_index(qx, qy, flat):
+    return flat_nearest(qx, qy, flat['mbr'], flat['child_start'], flat['child_count'],
+                        flat['leaf_start'], flat['leaf_count'], flat['pts_x'], flat['pts_y'], flat['stack_size'])
 
-    # Return the nearest neighbor from the R-tree with the smaller distance
-    return left_nearest if left_distance < right_distance else right_nearest
+# Best First search for many queries at once. The queries are independent, so Numba spreads them over all
+# CPU cores with prange; the compiled search does not hold the GIL. Returns the nearest point index per query.
+@njit(parallel=True, fastmath=True, cache=True)
+def flat_nearest_all(qxs, qys, mbr, child_start, child_count, leaf_start, leaf_count, pts_x, pts_y, stack_size):
+    nearest = np.empty(len(qxs), dtype=np.int64)
+    for i in prange(len(qxs)):
+        nearest[i] = flat_nearest(qxs[i], qys[i], mbr, child_start, child_count, leaf_start, leaf_count,
+                                  pts_x, pts_y, stack_size)
+    return nearest
+
+# Find the nearest neighbor of every query in a flattened R-tree, in parallel when there is more than one query.
+# Returns the index of each nearest point in the flattened R-tree, in query order.
+def parallel_best_first_search(queries, flat):
+    args = (flat['mbr'], flat['child_start'], flat['child_count'], flat['leaf_start'], flat['leaf_count'],
+            flat['pts_x'], flat['pts_y'], flat['stack_size'])
+    if len(queries['x']) > 1:
+        return flat_nearest_all(queries['x'], queries['y'], *args)
+    # A single query is not worth starting the worker threads for
+    return np.array([flat_nearest(qx, qy, *args) for qx, qy in zip(queries['x'], queries['y'])], dtype=np.int64)
 
-# Load dataset from a text file
+# Load dataset from a text file as three contiguous arrays (id, x, y).
+# The parsed values are cached in a binary .npy file next to the text file, stored as rows of ids, x and y values.
+# As long as the cache is newer than the text file it is memory-mapped instead of parsing the text again.
 def load_dataset(filename):
-    data = []
-    with open(filename, 'r') as file:
-        # Read each line and split the line into parts (id, x, y)
-        for line in file:
-            parts = line.split()
-            # Append the parsed data as a dictionary with id, x, and y coordinates
-            data.append({
-                'id': int(parts[0]),
-                'x': float(parts[1]),
-                'y': float(parts[2])
-            })
-    return data
+    cache = filename + '.npy'
+    if os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(filename):
+        arr = np.load(cache, mmap_mode='r')
+    else:
+        arr = np.ascontiguousarray(np.loadtxt(filename, ndmin=2).T)
+        np.save(cache, arr)
+    return {
+        'id': arr[0].astype(np.int64),
+        'x': arr[1],
+        'y': arr[2]
+    }
 
 def main():
     # Load the dataset of points (facilities) and query points
-    points_list = load_dataset("parking_dataset.txt")
-    queries = load_dataset("query_points.txt")
+    facilities = load_dataset("parking_dataset.txt")
+    query_data = load_dataset("query_points.txt")
+    num_queries = len(query_data['x'])
 
-    # Build the R-tree using the custom R-tree implementation
+    # Build the R-tree by bulk loading the facilities with Sort-Tile-Recursive packing
     print("Building R-tree...")
-    rtree = build_rtree(points_list)
+    flat_rtree = bulk_load(facilities)
+    # Compile the searches before they are timed
+    flat_best_first_index(query_data['x'][0], query_data['y'][0], flat_rtree)
+    parallel_best_first_search(query_data, flat_rtree)
     print("R-tree built successfully.")
 
-    # Divide the dataset into two halves and build separate R-trees for divide and conquer method
-    print("Dividing dataset and building separate R-trees for divide and conquer...")
-    left_rtree, right_rtree = build_rtree(points_list[:len(points_list)//2]), build_rtree(points_list[len(points_list)//2:])
-    print("Separate R-trees built successfully.")
-
-    # Initialize variables to track the total time taken by each search method
-    total_time_seq = 0
-    total_time_bf = 0
-    total_time_dac = 0
-
-    # Create a list to store the results of each query
-    results = []
-
-    # Process each query in 'queries'
-    for i, query in enumerate(queries):
-        # Sequential Scan - Find nearest neighbor using sequential scan method
-        start_time = time.time()
-        nearest_seq = sequential_scan(query, points_list)
-        total_time_seq += time.time() - start_time
-        results.append(f"Sequential Scan - Query {i + 1}: id={nearest_seq['id']}, x={nearest_seq['x']:.2f}, y={nearest_seq['y']:.2f}")
-
-        # Best First Search using R-tree - Find nearest neighbor using best first search algorithm
-        start_time = time.time()
-        nearest_bf = best_first_search(query, rtree)
-        total_time_bf += time.time() - start_time
-        results.append(f"Best First - Query {i + 1}: id={nearest_bf['id']}, x={nearest_bf['x']:.2f}, y={nearest_bf['y']:.2f}")
-
-        # Divide and Conquer with R-tree - Use divide and conquer method with two R-trees
-        start_time = time.time()
-        nearest_dac = divide_and_conquer_search(left_rtree, right_rtree, query)
-        total_time_dac += time.time() - start_time
-        results.append(f"Divide and Conquer - Query {i + 1}: id={nearest_dac['id']}, x={nearest_dac['x']:.2f}, y={nearest_dac['y']:.2f}")
-
-    # Calculate the average time taken for each method
-    average_time_seq = total_time_seq / len(queries)
-    average_time_bf = total_time_bf / len(queries)
-    average_time_dac = total_time_dac / len(queries)
+    # Sequential Scan - Find the nearest neighbor of every query in a single vectorized call
+    start_ns = time.perf_counter_ns()
+    nearest_seq_index = batch_sequential_scan(query_data, facilities)
+    total_ns_seq = time.perf_counter_ns() - start_ns
+
+    # Best First Search using R-tree - Find the nearest neighbor of each query in turn. Only the search itself is
+    # timed (with perf_counter_ns, which is monotonic and precise enough for a single query); the positions of the
+    # nearest points are collected and the results are formatted once at the end.
+    nearest_bf_index = np.empty(num_queries, dtype=np.int64)
+    total_ns_bf = 0
+    for i in range(num_queries):
+        qx, qy = float(query_data['x'][i]), float(query_data['y'][i])
+        start_ns = time.perf_counter_ns()
+        nearest_bf_index[i] = flat_best_first_index(qx, qy, flat_rtree)
+        total_ns_bf += time.perf_counter_ns() - start_ns
+
+    # Divide and Conquer - Divide the queries between the CPU cores and run the best first search on each core.
+    # The data set itself is not split into halves with separate R-trees: an R-tree already divides the space
+    # recursively, and halves that are not split spatially would both have to be searched in full for every query.
+    start_ns = time.perf_counter_ns()
+    nearest_dac_index = parallel_best_first_search(query_data, flat_rtree)
+    total_ns_dac = time.perf_counter_ns() - start_ns
+
+    # Reference - Find the nearest neighbor of every query with SciPy's cKDTree
+    start_ns = time.perf_counter_ns()
+    nearest_ref_index = kdtree_search(query_data, facilities)
+    total_ns_ref = time.perf_counter_ns() - start_ns
+
+    # The id and coordinates of the nearest neighbor found by each method, as arrays indexed by query
+    methods = [
+        ('Sequential Scan', facilities['id'][nearest_seq_index], facilities['x'][nearest_seq_index], facilities['y'][nearest_seq_index]),
+        ('Best First', flat_rtree['pts_id'][nearest_bf_index], flat_rtree['pts_x'][nearest_bf_index], flat_rtree['pts_y'][nearest_bf_index]),
+        ('Divide and Conquer', flat_rtree['pts_id'][nearest_dac_index], flat_rtree['pts_x'][nearest_dac_index], flat_rtree['pts_y'][nearest_dac_index]),
+    ]
+
+    # Count the queries for which each method found a point farther away than the reference did
+    # (ties between equally distant facilities are not counted)
+    reference_sq = (facilities['x'][nearest_ref_index] - query_data['x']) ** 2 + (facilities['y'][nearest_ref_index] - query_data['y']) ** 2
+    mismatches = {name: int(np.count_nonzero((xs - query_data['x']) ** 2 + (ys - query_data['y']) ** 2 > reference_sq))
+                  for name, _, xs, ys in methods}
+
+    # Format the result of every method for every query in one pass
+    columns = [(name, ids.tolist(), xs.tolist(), ys.tolist()) for name, ids, xs, ys in methods]
+    results = [f"{name} - Query {i + 1}: id={ids[i]}, x={xs[i]:.2f}, y={ys[i]:.2f}"
+               for i in range(num_queries) for name, ids, xs, ys in columns]
+
+    # Convert the totals to seconds and calculate the average time taken for each method
+    total_time_seq = total_ns_seq / 1e9
+    total_time_bf = total_ns_bf / 1e9
+    total_time_dac = total_ns_dac / 1e9
+    total_time_ref = total_ns_ref / 1e9
+    average_time_seq = total_time_seq / num_queries
+    average_time_bf = total_time_bf / num_queries
+    average_time_dac = total_time_dac / num_queries
+    average_time_ref = total_time_ref / num_queries
 
     # Add summary of total and average times for each method to the results
     results.append(f"\nTotal running time (Sequential Scan): {total_time_seq:.6f} seconds, Average time: {average_time_seq:.6f} seconds")
     results.append(f"Total running time (Best First): {total_time_bf:.6f} seconds, Average time: {average_time_bf:.6f} seconds")
     results.append(f"Total running time (Divide and Conquer): {total_time_dac:.6f} seconds, Average time: {average_time_dac:.6f} seconds")
+    results.append(f"Total running time (cKDTree Reference): {total_time_ref:.6f} seconds, Average time: {average_time_ref:.6f} seconds")
 
-    # Write all the results to a text file
+    # Write all the results to a text file in a single write
     output_filename = 'nearest_facilities_output1.txt'
     with open(output_filename, 'w') as f:
-        for line in results:
-            f.write(line + '\n')
+        f.write('\n'.join(results) + '\n')
 
     # Print a message confirming the output has been written
     print(f"Output written to {output_filename}")
+    for method, count in mismatches.items():
+        print(f"{method}: {num_queries - count} of {num_queries} queries match the cKDTree reference")
 
 # Entry point of the script
 if __name__ == '__main__':
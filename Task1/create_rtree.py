@@ -1,14 +1,15 @@
 import sys
 import math
+import numpy as np
 
 # B sets the maximum capacity for the number of data points or child nodes that each node can hold before it needs to split
-B = 4
+B = 8
 
 def main(points_list):
     """
     Builds an R-tree from the data points in the parking dataset. When the main function is executed, it initiates the construction of
     an R-tree using the data from the parking dataset. Each point from the dataset is inserted into the RTree, ensuring that each node
-    maintains a branching factor of B = 4 and that the Minimum Bounding Rectangles (MBRs) are as compact as possible.
+    maintains a branching factor of at most B and that the Minimum Bounding Rectangles (MBRs) are as compact as possible.
 
     Arguments:
         points_list (list of dict): A list of dictionaries, where each dictionary contains 'x' and 'y' coordinates representing the 
@@ -28,6 +29,22 @@ def main(points_list):
     return rtree  # Return the final constructed RTree root with the location of all its children
 
 
+def prefix_perimeters(x1, x2, y1, y2):
+    """
+    Computes the half-perimeter of the MBR enclosing the first i + 1 boxes, for every i, using running minimums and maximums.
+
+    Arguments:
+        x1, x2, y1, y2 (numpy.ndarray): The bounds of each box, in the order in which they are accumulated. Points are boxes 
+        with x1 == x2 and y1 == y2.
+
+    Returns:
+        numpy.ndarray: The half-perimeter of each prefix MBR.
+    """
+
+    return ((np.maximum.accumulate(x2) - np.minimum.accumulate(x1)) +
+            (np.maximum.accumulate(y2) - np.minimum.accumulate(y1)))
+
+
 class Node:
     """
     The base structure for a node in an R-tree, which can be a root, child, or leaf node. Each node stores essential information 
@@ -41,9 +58,12 @@ class Node:
         data_points (list of dict): A list of data points (represented as dictionaries with 'x' and 'y' coordinates) for leaf nodes. 
         For internal nodes, this list remains empty.
         parent (Node): The parent node of the current node, or `None` if the node is the root.
-        MBR (dict): A dictionary representing the Minimum Bounding Rectangle with keys 'x1', 'y1', 'x2', 'y2'.
+        MBR (list): The Minimum Bounding Rectangle as [x1, y1, x2, y2], indexed by position rather than by key.
     """
 
+    # Fixed attribute slots instead of a per-instance __dict__, which saves memory and speeds up attribute access
+    __slots__ = ('id', 'child_nodes', 'data_points', 'parent', 'MBR')
+
     def __init__(self):
         """
         Creates a new Node with default settings, ready to either store data points (as a leaf node) or link to child nodes (as an 
@@ -57,12 +77,7 @@ class Node:
 
         # Values of coordinates have been set to -1, assuming all coordinate values will be larger than this.
         # After each point insertion, MBR is updated for the associated nodes
-        self.MBR = {
-            'x1': -1,
-            'y1': -1,
-            'x2': -1,
-            'y2': -1,
-        }
+        self.MBR = [-1.0, -1.0, -1.0, -1.0]  # x1, y1, x2, y2
 
     def perimeter(self):
         """
@@ -74,7 +89,8 @@ class Node:
         float: The computed half-perimeter of the MBR.
         """
 
-        return (self.MBR['x2'] - self.MBR['x1']) + (self.MBR['y2'] - self.MBR['y1'])
+        m = self.MBR
+        return (m[2] - m[0]) + (m[3] - m[1])
 
     def is_overflow(self):
         """
@@ -130,9 +146,10 @@ class RTree:
 
     def insert(self, u, p):
         """
-        Inserts a data point into the R-tree, beginning from the specified node. If the node is a leaf, the data point is inserted directly.
-        If this causes an overflow, the appropriate overflow handling is triggered. If the node is not a leaf, the function recursively 
-        traverses the tree to locate the appropriate subtree for insertion, ensuring the point is placed in a way that minimizes MBR expansion.
+        Inserts a data point into the R-tree, beginning from the specified node. The tree is descended to a leaf by repeatedly choosing 
+        the subtree that minimizes MBR expansion, and the nodes passed on the way are recorded in a path. The data point is inserted into 
+        the leaf, an overflow is handled if one occurs, and the MBRs along the path are then updated from the bottom up. The descent is a 
+        loop rather than a recursive call, so no Python frames are created per level and the recursion limit does not apply.
 
         Arguments:
         u (Node): The node where the insertion begins.
@@ -142,14 +159,17 @@ class RTree:
         None: The method modifies the R-tree structure in place without returning a value.
         """
 
-        if u.is_leaf(): 
-            self.add_data_point(u, p)  # Add the data point and update the corresponding MBR
-            if u.is_overflow():
-                self.handle_overflow(u)  # Handle overflow for leaf nodes
-        else:
-            v = self.choose_subtree(u, p)  # Choose a subtree to insert the data point to minimize the perimeter sum
-            self.insert(v, p)  # Continue recursively until a leaf node is reached
-            self.update_mbr(v)  # Update the MBR after insertion
+        path = []  # The nodes below u that the descent passes through
+        while not u.is_leaf():
+            u = self.choose_subtree(u, p)  # Choose a subtree to insert the data point to minimize the perimeter sum
+            path.append(u)
+
+        self.add_data_point(u, p)  # Add the data point and update the corresponding MBR
+        if u.is_overflow():
+            self.handle_overflow(u)  # Handle overflow for leaf nodes
+
+        for node in reversed(path):
+            self.update_mbr(node)  # Update the MBRs after insertion, deepest node first
 
     def choose_subtree(self, u, p): 
         """
@@ -193,7 +213,7 @@ class RTree:
         """
 
         origin_mbr = node.MBR
-        x1, x2, y1, y2 = origin_mbr['x1'], origin_mbr['x2'], origin_mbr['y1'], origin_mbr['y2']
+        x1, y1, x2, y2 = origin_mbr
         
         # Calculate new MBR after adding the new point
         new_x1 = min(x1, p['x'])
@@ -219,30 +239,33 @@ class RTree:
         None: This method modifies the tree structure in-place by splitting the overflowing node and, if necessary, creating a new root.
         """
 
-        # Get the best split of two MBR based on whether u is a leaf node or an internal node.
-        u1, u2 = self.split(u)  # u1 and u2 are the two splits returned by the split function
+        while True:
+            # Get the best split of two MBR based on whether u is a leaf node or an internal node.
+            u1, u2 = self.split(u)  # u1 and u2 are the two splits returned by the split function
+
+            if u.is_root():
+                new_root = Node()  # Create a new root
+                self.add_child(new_root, u1) 
+                self.add_child(new_root, u2)
+                self.root = new_root
+                self.update_mbr(new_root)
+                return
 
-        if u.is_root():
-            new_root = Node()  # Create a new root
-            self.add_child(new_root, u1) 
-            self.add_child(new_root, u2)
-            self.root = new_root
-            self.update_mbr(new_root)
-        else:
             w = u.parent  # Parent node where u was a child
             w.child_nodes.remove(u)
             self.add_child(w, u1)  # Link the two splits and update the corresponding MBR
             self.add_child(w, u2)
-            if w.is_overflow():  # Check recursively if the parent node now overflows
-                self.handle_overflow(w) 
+            if not w.is_overflow():
+                return
+            u = w  # The parent node now overflows, so continue splitting one level up
 
     def split(self, u):
         """
         Splits an overflowing node into two separate nodes to preserve the balance and efficiency of the R-tree structure. This method 
         assesses different splitting strategies based on the spatial arrangement of data points or child nodes within the node. The split 
         is optimized to minimize the combined perimeter of the resulting nodes, ensuring efficient space utilization and maintaining 
-        tree balance. The function accounts for multiple dimensions and seeks to find the optimal split to reduce future overlap and 
-        perimeter increase.
+        tree balance. For every sort order, the MBRs of all prefixes and suffixes of the sorted entries are computed at once with running 
+        minimums and maximums, so the perimeter sum of every candidate split is known without building trial nodes.
 
         Arguments:
         u (Node): The node to be split, which has exceeded its capacity due to an insertion.
@@ -252,53 +275,45 @@ class RTree:
         a balanced distribution of data points or child nodes.
         """
 
-        best_s1 = Node()
-        best_s2 = Node()
+        if u.is_leaf():
+            entries = u.data_points
+            xs = np.array([data_point['x'] for data_point in entries])
+            ys = np.array([data_point['y'] for data_point in entries])
+            boxes = (xs, xs, ys, ys)
+            # Two different kinds of divides: sorted by 'x' and sorted by 'y'
+            sort_keys = (xs, ys)
+        else:
+            entries = u.child_nodes
+            boxes = tuple(np.array([child_node.MBR[i] for child_node in entries]) for i in (0, 2, 1, 3))  # x1, x2, y1, y2
+            # Four different kinds of divides based on MBR coordinates
+            sort_keys = boxes
+
+        m = len(entries)
+        k = math.ceil(0.4 * B)  # Minimum number of entries in each of the two nodes
         best_perimeter = sys.maxsize
+        for sort_key in sort_keys:
+            order = np.argsort(sort_key, kind='stable')
+            x1, x2, y1, y2 = (box[order] for box in boxes)
+            # prefix[i] is the half-perimeter of the first i + 1 entries, suffix[i] that of the entries from i onwards
+            prefix = prefix_perimeters(x1, x2, y1, y2)
+            suffix = prefix_perimeters(x1[::-1], x2[::-1], y1[::-1], y2[::-1])[::-1]
+            # Perimeter sum of splitting into divide[:i] and divide[i:] for i = k, ..., m - k
+            perimeters = prefix[k - 1:m - k] + suffix[k:m - k + 1]
+            i = int(np.argmin(perimeters))
+            if perimeters[i] < best_perimeter:
+                best_perimeter = perimeters[i]
+                best_order, best_i = order, i + k
 
+        best_s1 = Node()
+        best_s2 = Node()
         if u.is_leaf():
-            m = len(u.data_points)
-            # Create two different kinds of divides: sorted by 'x' and sorted by 'y'
-            divides = [
-                sorted(u.data_points, key=lambda data_point: data_point['x']),
-                sorted(u.data_points, key=lambda data_point: data_point['y'])
-            ]
-            for divide in divides:
-                for i in range(math.ceil(0.4 * B), m - math.ceil(0.4 * B) + 1):
-                    s1 = Node()
-                    s1.data_points = divide[:i]
-                    self.update_mbr(s1)
-                    s2 = Node()
-                    s2.data_points = divide[i:]
-                    self.update_mbr(s2)
-                    current_perimeter = s1.perimeter() + s2.perimeter()
-                    if current_perimeter < best_perimeter:
-                        best_perimeter = current_perimeter
-                        best_s1 = s1
-                        best_s2 = s2
-
+            best_s1.data_points = [entries[j] for j in best_order[:best_i]]
+            best_s2.data_points = [entries[j] for j in best_order[best_i:]]
         else:
-            m = len(u.child_nodes)
-            # Create four different kinds of divides based on MBR coordinates
-            divides = [
-                sorted(u.child_nodes, key=lambda child_node: child_node.MBR['x1']),
-                sorted(u.child_nodes, key=lambda child_node: child_node.MBR['x2']),
-                sorted(u.child_nodes, key=lambda child_node: child_node.MBR['y1']),
-                sorted(u.child_nodes, key=lambda child_node: child_node.MBR['y2'])
-            ]
-            for divide in divides:
-                for i in range(math.ceil(0.4 * B), m - math.ceil(0.4 * B) + 1):
-                    s1 = Node()
-                    s1.child_nodes = divide[:i]
-                    self.update_mbr(s1)
-                    s2 = Node()
-                    s2.child_nodes = divide[i:]
-                    self.update_mbr(s2)
-                    current_perimeter = s1.perimeter() + s2.perimeter()
-                    if current_perimeter < best_perimeter:
-                        best_perimeter = current_perimeter
-                        best_s1 = s1
-                        best_s2 = s2
+            best_s1.child_nodes = [entries[j] for j in best_order[:best_i]]
+            best_s2.child_nodes = [entries[j] for j in best_order[best_i:]]
+        self.update_mbr(best_s1)
+        self.update_mbr(best_s2)
 
         # Update parent references for child nodes
         for child in best_s1.child_nodes:
@@ -324,10 +339,10 @@ class RTree:
         node.child_nodes.append(child)  # Add child node to the current parent node
         child.parent = node 
         # Update the MBR to reflect the addition of the new child
-        node.MBR['x1'] = min(node.MBR['x1'], child.MBR['x1'])
-        node.MBR['x2'] = max(node.MBR['x2'], child.MBR['x2'])
-        node.MBR['y1'] = min(node.MBR['y1'], child.MBR['y1'])
-        node.MBR['y2'] = max(node.MBR['y2'], child.MBR['y2'])
+        node.MBR[0] = min(node.MBR[0], child.MBR[0])
+        node.MBR[2] = max(node.MBR[2], child.MBR[2])
+        node.MBR[1] = min(node.MBR[1], child.MBR[1])
+        node.MBR[3] = max(node.MBR[3], child.MBR[3])
 
     def add_data_point(self, node, data_point):
         """
@@ -346,10 +361,10 @@ class RTree:
         node.data_points.append(data_point)
 
         # Update the MBR to reflect the addition of the new data point
-        node.MBR['x1'] = min(node.MBR['x1'], data_point['x'])
-        node.MBR['x2'] = max(node.MBR['x2'], data_point['x'])
-        node.MBR['y1'] = min(node.MBR['y1'], data_point['y'])
-        node.MBR['y2'] = max(node.MBR['y2'], data_point['y'])
+        node.MBR[0] = min(node.MBR[0], data_point['x'])
+        node.MBR[2] = max(node.MBR[2], data_point['x'])
+        node.MBR[1] = min(node.MBR[1], data_point['y'])
+        node.MBR[3] = max(node.MBR[3], data_point['y'])
 
     def update_mbr(self, node):
         """
@@ -373,13 +388,196 @@ class RTree:
             y_list = [point['y'] for point in node.data_points]
         else:
             # For internal nodes, consider the 'x1', 'x2', 'y1', 'y2' of all child nodes
-            x_list = [child.MBR['x1'] for child in node.child_nodes] + [child.MBR['x2'] for child in node.child_nodes]
-            y_list = [child.MBR['y1'] for child in node.child_nodes] + [child.MBR['y2'] for child in node.child_nodes]
+            x_list = [child.MBR[0] for child in node.child_nodes] + [child.MBR[2] for child in node.child_nodes]
+            y_list = [child.MBR[1] for child in node.child_nodes] + [child.MBR[3] for child in node.child_nodes]
         
         # Update the MBR with the new min and max values
-        node.MBR = {
-            'x1': min(x_list),
-            'x2': max(x_list),
-            'y1': min(y_list),
-            'y2': max(y_list)
-        }
+        node.MBR = [min(x_list), min(y_list), max(x_list), max(y_list)]
+
+
+def flatten(rtree):
+    """
+    Converts a constructed R-tree into an arena of NumPy arrays so that it can be searched without touching Python Node objects.
+    Nodes are numbered level by level starting from the root (index 0), which places the children of every internal node at
+    consecutive indices. The data points of every leaf are likewise stored consecutively in the point arrays.
+
+    Arguments:
+        rtree (RTree): The R-tree to be flattened.
+
+    Returns:
+        dict: The flattened R-tree with the following arrays, all indexed by node number unless stated otherwise:
+            'mbr' (float64, shape (M, 4)): The MBR of each node as a row [x1, y1, x2, y2].
+            'child_start', 'child_count' (int32): The index of the first child and the number of children (0 for leaves).
+            'leaf_start', 'leaf_count' (int32): The position of the first data point of a leaf and the number of its data points.
+            'pts_x', 'pts_y' (float64), 'pts_id' (int64): The data points of all leaves, indexed by point position.
+            'stack_size' (int): An upper bound on the number of pending nodes during a depth-first traversal.
+    """
+
+    # Number the nodes level by level so that siblings end up next to each other
+    nodes = [rtree.root]
+    height = 1
+    level_start = 0
+    while level_start < len(nodes):
+        level_end = len(nodes)
+        for node in nodes[level_start:level_end]:
+            nodes.extend(node.child_nodes)
+        if len(nodes) > level_end:
+            height += 1
+        level_start = level_end
+
+    m = len(nodes)
+    flat = {
+        'mbr': np.array([node.MBR for node in nodes], dtype=np.float64).reshape(m, 4),
+        'child_start': np.zeros(m, dtype=np.int32),
+        'child_count': np.zeros(m, dtype=np.int32),
+        'leaf_start': np.zeros(m, dtype=np.int32),
+        'leaf_count': np.zeros(m, dtype=np.int32),
+    }
+    pts_x, pts_y, pts_id = [], [], []
+    next_child = 1  # The root occupies index 0, so its children start at index 1
+    for i, node in enumerate(nodes):
+        if node.is_leaf():
+            flat['leaf_start'][i] = len(pts_x)
+            flat['leaf_count'][i] = len(node.data_points)
+            for point in node.data_points:
+                pts_x.append(point['x'])
+                pts_y.append(point['y'])
+                pts_id.append(point['id'])
+        else:
+            flat['child_start'][i] = next_child
+            flat['child_count'][i] = len(node.child_nodes)
+            next_child += len(node.child_nodes)
+
+    flat['pts_x'] = np.array(pts_x, dtype=np.float64)
+    flat['pts_y'] = np.array(pts_y, dtype=np.float64)
+    flat['pts_id'] = np.array(pts_id, dtype=np.int64)
+    # At most one node per level is expanded at a time, and each expansion pushes at most its children
+    flat['stack_size'] = height * max(int(flat['child_count'].max()), 1) + 1
+    return flat
+
+
+class FlatNode:
+    """
+    A read-only view of one node of a flattened R-tree with the same interface as Node. It is meant for inspecting and
+    debugging a flattened tree; the searches read the arrays directly.
+
+    Attributes:
+        id (int): The index of the node in the flattened R-tree.
+        flat (dict): The flattened R-tree the node belongs to.
+    """
+
+    def __init__(self, flat, id=0):
+        self.flat = flat
+        self.id = id
+
+    @property
+    def MBR(self):
+        return self.flat['mbr'][self.id].tolist()
+
+    @property
+    def child_nodes(self):
+        start = self.flat['child_start'][self.id]
+        return [FlatNode(self.flat, c) for c in range(start, start + self.flat['child_count'][self.id])]
+
+    @property
+    def data_points(self):
+        start = self.flat['leaf_start'][self.id]
+        return [{'id': int(self.flat['pts_id'][j]), 'x': float(self.flat['pts_x'][j]), 'y': float(self.flat['pts_y'][j])}
+                for j in range(start, start + self.flat['leaf_count'][self.id])]
+
+    def perimeter(self):
+        x1, y1, x2, y2 = self.MBR
+        return (x2 - x1) + (y2 - y1)
+
+    def is_root(self):
+        return self.id == 0
+
+    def is_leaf(self):
+        return self.flat['child_count'][self.id] == 0
+
+
+def str_order(cx, cy, capacity):
+    """
+    Computes the Sort-Tile-Recursive (STR) ordering of a set of 2-D entries. The entries are sorted by x and cut into
+    ceil(sqrt(n / capacity)) vertical strips, then each strip is sorted by y. Taking consecutive groups of `capacity`
+    entries from the resulting order yields spatially compact nodes.
+
+    Arguments:
+        cx (numpy.ndarray): The x coordinate of each entry (the point itself, or the centre of an MBR).
+        cy (numpy.ndarray): The y coordinate of each entry.
+        capacity (int): The number of entries that will be packed into each node.
+
+    Returns:
+        numpy.ndarray: The permutation of entry indices in STR order.
+    """
+
+    n = len(cx)
+    strips = math.ceil(math.sqrt(math.ceil(n / capacity)))
+    strip_size = math.ceil(math.ceil(n / capacity) / strips) * capacity  # A multiple of capacity, so no node spans two strips
+    order = np.argsort(cx, kind='stable')
+    for start in range(0, n, strip_size):
+        strip = order[start:start + strip_size]
+        order[start:start + strip_size] = strip[np.argsort(cy[strip], kind='stable')]
+    return order
+
+
+def bulk_load(points):
+    """
+    Builds a flattened R-tree (in the arena layout produced by `flatten`) with Sort-Tile-Recursive bulk loading instead of
+    inserting the points one at a time. The points are packed B at a time into leaves in STR order, and each level above
+    is built the same way by packing the MBR centres of the level below, until a single root remains. The whole build
+    consists of a few NumPy sorts per level, with no overflow handling or node splitting.
+
+    Arguments:
+        points (dict): The data points as three arrays under the keys 'id', 'x' and 'y'.
+
+    Returns:
+        dict: The flattened R-tree, see `flatten` for a description of its arrays.
+    """
+
+    xs = np.asarray(points['x'], dtype=np.float64)
+    ys = np.asarray(points['y'], dtype=np.float64)
+    order = str_order(xs, ys, B)
+    pts_x = np.ascontiguousarray(xs[order])
+    pts_y = np.ascontiguousarray(ys[order])
+    pts_id = np.asarray(points['id'], dtype=np.int64)[order]
+
+    # Leaf level: each leaf holds B consecutive points (the last one may hold fewer)
+    n = len(pts_x)
+    starts = np.arange(0, n, B, dtype=np.int32)
+    counts = np.minimum(B, n - starts).astype(np.int32)
+    # The MBRs of all leaves in one pass: minimum and maximum over each group of consecutive points
+    pts = np.column_stack([pts_x, pts_y])
+    mbr = np.hstack([np.minimum.reduceat(pts, starts), np.maximum.reduceat(pts, starts)])
+    levels = [{'mbr': mbr,
+               'child_start': np.zeros(len(starts), dtype=np.int32), 'child_count': np.zeros(len(starts), dtype=np.int32),
+               'leaf_start': starts, 'leaf_count': counts}]
+
+    # Internal levels: pack the nodes of the level below B at a time until only the root is left
+    while len(levels[-1]['mbr']) > 1:
+        below = levels[-1]
+        order = str_order((below['mbr'][:, 0] + below['mbr'][:, 2]) / 2, (below['mbr'][:, 1] + below['mbr'][:, 3]) / 2, B)
+        for key in below:
+            below[key] = below[key][order]  # Reorder the level below so that siblings are consecutive
+
+        m = len(order)
+        starts = np.arange(0, m, B, dtype=np.int32)
+        counts = np.minimum(B, m - starts).astype(np.int32)
+        mbr = np.hstack([np.minimum.reduceat(below['mbr'][:, :2], starts), np.maximum.reduceat(below['mbr'][:, 2:], starts)])
+        levels.append({'mbr': mbr,
+                       'child_start': starts, 'child_count': counts,
+                       'leaf_start': np.zeros(len(starts), dtype=np.int32), 'leaf_count': np.zeros(len(starts), dtype=np.int32)})
+
+    # Number the nodes level by level from the root, shifting child indices to the start of the level below
+    levels.reverse()
+    offset = 0
+    for level in levels[:-1]:
+        offset += len(level['mbr'])
+        level['child_start'] = (level['child_start'] + offset).astype(np.int32)
+    flat = {key: np.concatenate([level[key] for level in levels]) for key in levels[0]}
+
+    flat['pts_x'] = pts_x
+    flat['pts_y'] = pts_y
+    flat['pts_id'] = pts_id
+    flat['stack_size'] = len(levels) * B + 1
+    return flat
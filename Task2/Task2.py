@@ -1,130 +1,279 @@
 # skyline_search.py
+import argparse  # I use this to read the command line options
 import time  # I use this to measure how long each algorithm takes to run
+from contextlib import contextmanager  # I use this to write the timing code once
+import heapq  # I use a heap as the priority queue of the BBS search
+import itertools  # I use a counter to break ties between nodes at the same distance
+from concurrent.futures import ProcessPoolExecutor  # I use this to work on the two halves of divide-and-conquer at the same time
+import numpy as np  # I keep the coordinates in NumPy arrays so that whole columns can be processed at once
+from numba import njit  # I compile the dominance checks of the BBS search to machine code
 import create_rtree  # I import my R-tree functions from the create_rtree module
 
-# This function reads a dataset from a file and turns it into a list of points (each as a dictionary)
+# This function reads a dataset from a file into three arrays: the x values, the y values and the IDs.
+# All the functions below take the points as these arrays, and return the positions of the skyline points in them.
 def read_dataset(file_path):
-    points_list = []  # This will hold all the points from the file
-    with open(file_path, 'r') as file:  # I open the file in read mode
-        for line in file:  # I go through each line in the file
-            parts = line.strip().split()  # Split the line into parts (ID, x, y)
-            point = {'id': parts[0], 'x': float(parts[1]), 'y': float(parts[2])}  # Create a dictionary for the point
-            points_list.append(point)  # Add the point to the list
-    return points_list  # Return the complete list of points
-
-# This function checks if point 'a' dominates point 'b'
+    # NumPy parses the whole file in C, instead of building one dictionary per line in Python.
+    # I keep the coordinates as 32-bit floats, which halves their memory: the values have two decimals and fewer than
+    # seven digits, so different values stay different and keep their order, which is all the skyline needs
+    data = np.loadtxt(file_path, dtype=[('id', 'U32'), ('x', 'f4'), ('y', 'f4')], ndmin=1)
+    return np.ascontiguousarray(data['x']), np.ascontiguousarray(data['y']), data['id']
+
+# This function replaces each coordinate by its rank among the distinct values of its column (0 for the smallest).
+# Dominance only compares coordinates, and the ranks give exactly the same result for every comparison (ties
+# included) while taking 4-byte integers, so I run the skyline searches on the ranks and keep the original
+# coordinates for the output
+def quantize(values):
+    return np.unique(values, return_inverse=True)[1].astype(np.int32).reshape(values.shape)
+
+# This function checks if point 'a' dominates point 'b', where each point is an (x, y) pair
 def dominates(a, b):
     # 'a' dominates 'b' if 'a' is cheaper or the same price and bigger in size, and one of these conditions is strictly true
-    return a['x'] <= b['x'] and a['y'] >= b['y'] and (a['x'] < b['x'] or a['y'] > b['y'])
+    return a[0] <= b[0] and a[1] >= b[1] and (a[0] < b[0] or a[1] > b[1])
 
 # This function finds the skyline points using a simple, straightforward method (sequential scan)
-def sequential_scan_skyline(points_list):
-    skyline = []  # This will store the skyline points
-    for point in points_list:  # For each point in the list
+def sequential_scan_skyline(xs, ys):
+    points = list(zip(xs.tolist(), ys.tolist()))
+    skyline = []  # This will store the positions of the skyline points
+    for i, point in enumerate(points):  # For each point in the list
         # If no other point dominates this point, it's part of the skyline
-        if not any(dominates(other, point) for other in points_list):
-            skyline.append(point)  # Add the point to the skyline
+        if not any(dominates(other, point) for other in points):
+            skyline.append(i)  # Add the point to the skyline
     # Sort the skyline points by cost (x) in ascending order and by size (y) in descending order
-    return sorted(skyline, key=lambda p: (p['x'], -p['y']))
+    return sorted(skyline, key=lambda i: (points[i][0], -points[i][1]))
+
+# This function finds the skyline with a single sort and sweep instead of comparing every pair of points.
+# After sorting by cost (x) ascending and size (y) descending, a point is in the skyline exactly when it has the
+# largest y among the points with the same x, and a larger y than every point with a smaller x.
+# It returns the positions of the skyline points, sorted by x ascending and y descending.
+def sequential_scan_skyline_np(xs, ys):
+    order = np.lexsort((-ys, xs))  # Sort by x, and by y descending when x is tied
+    xs_sorted, ys_sorted = xs[order], ys[order]
+    n = len(order)
+    if n == 0:
+        return order  # No points, so the skyline is empty
+    # For every point, the position of the first point with the same x (which has the largest y for that x)
+    new_x = np.ones(n, dtype=bool)
+    new_x[1:] = xs_sorted[1:] != xs_sorted[:-1]
+    group_first = np.maximum.accumulate(np.where(new_x, np.arange(n), 0))
+    # The largest y among all points with a smaller x
+    max_before = np.empty(n)
+    max_before[0] = -np.inf
+    max_before[1:] = np.maximum.accumulate(ys_sorted)[:-1]
+    max_before = max_before[group_first]
+    mask = (ys_sorted == ys_sorted[group_first]) & (ys_sorted > max_before)
+    return order[mask]
+
+# The compiled helpers use fastmath, which assumes there are no infinities, so they start from the largest float instead
+FAR = np.finfo(np.float64).max
+
+# This function checks if the point (px, py) is dominated by any of the first n skyline points, whose coordinates are
+# kept in two arrays, sky_x and sky_y. It is compiled when the module is imported (the signature is given up front),
+# so no compilation happens while timing.
+@njit('b1(f8[:], f8[:], i8, f8, f8)', cache=True, fastmath=True)
+def _dominated_by_skyline(sky_x, sky_y, n, px, py):
+    for k in range(n):
+        sx = sky_x[k]
+        sy = sky_y[k]
+        if sx <= px and sy >= py and (sx < px or sy > py):
+            return True
+    return False
+
+# This function checks a whole batch of points (px[j], py[j]) against the skyline at once, and returns True for each
+# point that is dominated
+@njit('b1[:](f8[:], f8[:], i8, f8[:], f8[:])', cache=True, fastmath=True)
+def _dominated_mask(sky_x, sky_y, n, px, py):
+    mask = np.empty(len(px), dtype=np.bool_)
+    for j in range(len(px)):
+        mask[j] = _dominated_by_skyline(sky_x, sky_y, n, px[j], py[j])
+    return mask
+
+# This function adds the point (px, py) to the skyline, after removing in place the skyline points that it dominates.
+# refs holds, for each skyline point, a reference to where the point came from, and is compacted together with the
+# coordinates. It returns the new number of skyline points; the arrays must have room for one more point.
+@njit('i8(f8[:], f8[:], i8[:], i8, f8, f8, i8)', cache=True, fastmath=True)
+def _insert_and_prune(sky_x, sky_y, refs, n, px, py, ref):
+    m = 0
+    for k in range(n):
+        sx = sky_x[k]
+        sy = sky_y[k]
+        if not (px <= sx and py >= sy and (px < sx or py > sy)):
+            sky_x[m] = sx
+            sky_y[m] = sy
+            refs[m] = refs[k]
+            m += 1
+    sky_x[m] = px
+    sky_y[m] = py
+    refs[m] = ref
+    return m + 1
 
-# This function calculates the minimum distance from the origin (0, 0) to the MBR of a node
-def mindist_to_origin(mbr):
-    return mbr['x1']**2 + mbr['y2']**2  # Calculate the squared distance (no need for the square root)
+# This function adds a batch of points (px[j], py[j]), one after the other, to the skyline: each point that is not
+# dominated goes in with the reference first_ref + j. It returns the new number of skyline points; the arrays must
+# have room for all the points of the batch.
+# Before checking a point against the skyline, I check it against the point of the batch seen so far with the largest
+# y (and the smallest x among those), which I keep in (bx, by). A point it dominates can't be in the skyline, so I skip
+# it without scanning the skyline. When the batch is sorted by x ascending and y descending, as in the leaves of a
+# bulk-loaded R-tree, this catches every point that another point of the batch dominates.
+@njit('i8(f8[:], f8[:], i8[:], i8, f8[:], f8[:], i8)', cache=True, fastmath=True)
+def _add_points(sky_x, sky_y, refs, n, px, py, first_ref):
+    bx = FAR
+    by = -FAR
+    for j in range(len(px)):
+        x = px[j]
+        y = py[j]
+        if bx <= x and by >= y and (bx < x or by > y):
+            continue
+        if y > by or (y == by and x < bx):
+            bx = x
+            by = y
+        if not _dominated_by_skyline(sky_x, sky_y, n, x, y):
+            n = _insert_and_prune(sky_x, sky_y, refs, n, x, y, first_ref + j)
+    return n
 
 # This function performs the BBS algorithm to find skyline points using an R-tree
 def bbs_skyline_search(rtree):
-    skyline = []  # This will store the final skyline points
-    # Start with a list that contains the root node and its distance to the origin
-    L = [(mindist_to_origin(rtree.root.MBR), rtree.root)]
-    L.sort(key=lambda x: x[0])  # Sort the list by distance to the origin
+    # The skyline is kept in two NumPy arrays, one for x and one for y, that grow when they are full, so that the
+    # compiled helpers can check it. refs links each skyline point to its position in 'candidates', the data points
+    # of the leaves visited so far.
+    sky_x = np.empty(64)
+    sky_y = np.empty(64)
+    refs = np.empty(64, dtype=np.int64)
+    n_sky = 0
+    candidates = []
+    # Start with a heap that contains the root node and its distance to the origin (each node keeps the squared
+    # distance from the origin to its MBR in _mindist, so I don't recalculate it here).
+    # Each entry also holds a number from a counter, so that nodes at the same distance are taken in the order
+    # they were added and two nodes are never compared with each other.
+    order = itertools.count()
+    L = [(rtree.root._mindist, next(order), rtree.root)]
 
-    while L:  # Keep processing until the list is empty
-        _, node = L.pop(0)  # Get the node with the smallest distance and remove it from the list
+    while L:  # Keep processing until the heap is empty
+        _, _, node = heapq.heappop(L)  # Get the node with the smallest distance and remove it from the heap
+        boxes = node.child_mbrs[:node.n_children]  # The boxes of the node's entries, one row [x1, y1, x2, y2] each
         if node.is_leaf():  # If the node is a leaf, I process its data points
-            for point in node.data_points:
-                # If the point is not dominated by any point in the current skyline, add it
-                if not any(dominates(sky_point, point) for sky_point in skyline):
-                    # Remove points from the skyline that are dominated by this new point
-                    skyline = [sky_point for sky_point in skyline if not dominates(point, sky_point)]
-                    skyline.append(point)  # Add the new point to the skyline
+            if n_sky + len(boxes) > len(sky_x):  # I double the arrays when they could overflow
+                sky_x = np.concatenate([sky_x, np.empty_like(sky_x)])
+                sky_y = np.concatenate([sky_y, np.empty_like(sky_y)])
+                refs = np.concatenate([refs, np.empty_like(refs)])
+            # I add every data point that is not dominated to the skyline, removing the skyline points it dominates,
+            # all in one compiled call (the leaf stores its points as boxes [x, y, x, y])
+            n_sky = _add_points(sky_x, sky_y, refs, n_sky, boxes[:, 0], boxes[:, 1], len(candidates))
+            candidates.extend(node.data_points)
         else:  # If the node is not a leaf, I process its child nodes
-            for child in node.child_nodes:
-                # I use the top-left corner of the child's MBR as a point for comparison
-                child_mbr_point = {'x': child.MBR['x1'], 'y': child.MBR['y2']}
-                # If this MBR point is not dominated by the skyline, I add the child node to the list
-                if not any(dominates(sky_point, child_mbr_point) for sky_point in skyline):
-                    L.append((mindist_to_origin(child.MBR), child))
-            L.sort(key=lambda x: x[0])  # Sort the list again after adding new nodes
-    return skyline  # Return the final list of skyline points
-
-# This function splits the dataset into two subspaces for divide-and-conquer
-def divide_dataset(points_list, dimension='x'):
+            # I use the top-left corner (x1, y2) of each child's MBR as a point for comparison, and check them all at once
+            dominated = _dominated_mask(sky_x, sky_y, n_sky, boxes[:, 0], boxes[:, 3])
+            for child, is_dominated in zip(node.child_nodes, dominated):
+                # If this MBR point is not dominated by the skyline, I add the child node to the heap
+                if not is_dominated:
+                    heapq.heappush(L, (child._mindist, next(order), child))
+    # Return the final list of skyline points, as the entries stored in the leaves (for a bulk-loaded R-tree, the
+    # positions of the points in the arrays the tree was built from)
+    return [candidates[r] for r in refs[:n_sky]]
+
+# This function splits the dataset into two subspaces for divide-and-conquer, and returns the positions of the points
+# in each of them. If the positions of the points sorted by the chosen dimension are already known, they can be passed
+# as 'order' so that they are not sorted again
+def divide_dataset(xs, ys, dimension='x', order=None):
     # Sort the points by the chosen dimension (x or y)
-    sorted_points = sorted(points_list, key=lambda p: p[dimension])
-    mid_index = len(sorted_points) // 2  # Find the middle index
-    # Return two halves of the sorted list
-    return sorted_points[:mid_index], sorted_points[mid_index:]
+    if order is None:
+        order = np.argsort(xs if dimension == 'x' else ys, kind='stable')
+    mid_index = len(order) // 2  # Find the middle index
+    # Return two halves of the sorted positions
+    return order[:mid_index], order[mid_index:]
+
+# This function builds an R-tree for one subspace and finds its skyline. It is a top-level function so that it can be
+# sent to another process. The points of a subspace are already sorted by x, so the R-tree doesn't sort them by x again
+def _build_and_bbs(xs, ys):
+    return bbs_skyline_search(create_rtree.main(xs, ys, x_order=np.arange(len(xs))))
 
-# This function applies the BBS algorithm using a divide-and-conquer approach
-def bbs_divide_and_conquer(points_list):
+# This function applies the BBS algorithm using a divide-and-conquer approach. x_order can give the positions of the
+# points sorted by x (a stable sort), if they are already known
+def bbs_divide_and_conquer(xs, ys, x_order=None):
     # Split the dataset into two subspaces
-    subspace1, subspace2 = divide_dataset(points_list)
-    # Build an R-tree for each subspace and find the skyline for each
-    rtree1 = create_rtree.main(subspace1)
-    rtree2 = create_rtree.main(subspace2)
-
-    skyline1 = bbs_skyline_search(rtree1)
-    skyline2 = bbs_skyline_search(rtree2)
-
-    # Combine the two skylines and filter out dominated points
-    combined_skyline = skyline1 + skyline2
-    final_skyline = []
-    for point in combined_skyline:
-        if not any(dominates(other_point, point) for other_point in combined_skyline):
-            final_skyline.append(point)  # Add the point if it is not dominated
-    return final_skyline  # Return the final combined skyline
-
-# The main function orchestrates the execution of the different skyline algorithms
-def main():
+    subspace1, subspace2 = divide_dataset(xs, ys, order=x_order)
+    # Build an R-tree for each subspace and find the skyline for each. The two halves are independent, so I run them
+    # in two processes at the same time (building the R-tree is Python code, so threads would not run in parallel)
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        future1 = executor.submit(_build_and_bbs, xs[subspace1], ys[subspace1])
+        future2 = executor.submit(_build_and_bbs, xs[subspace2], ys[subspace2])
+        # Each half gives positions within that half, which I turn back into positions in xs and ys
+        skyline1, skyline2 = subspace1[future1.result()], subspace2[future2.result()]
+
+    # Combine the two skylines and filter out dominated points. The skyline of the union is the skyline of the two
+    # skylines, so I run the same sort and sweep as the sequential scan over their coordinates
+    # (I sort the positions first, so that points with the same coordinates come out in the order of the dataset)
+    combined_skyline = np.sort(np.concatenate([skyline1, skyline2]))
+    final_skyline = combined_skyline[sequential_scan_skyline_np(xs[combined_skyline], ys[combined_skyline])]
+    return final_skyline  # Return the final combined skyline, sorted by x ascending and y descending
+
+# This context manager times the code inside its 'with' block using perf_counter_ns, which is monotonic and much more
+# precise than time.time(). It gives a dictionary in which the time taken is stored under 'seconds' when the block ends,
+# so the results can be written out before the time
+@contextmanager
+def timed():
+    timer = {}
+    start_ns = time.perf_counter_ns()
+    yield timer
+    timer['seconds'] = (time.perf_counter_ns() - start_ns) / 1e9
+
+# This function formats the skyline points at the given positions as one block of text, with a line "id x y" per point.
+# I format the coordinates with str(), which writes a 32-bit float with the fewest digits that identify it
+# (300.2 rather than 300.20001220703125)
+def format_skyline(positions, xs, ys, ids):
+    return "".join([f"{i} {x!s} {y!s}\n" for i, x, y in zip(ids[positions], xs[positions], ys[positions])])
+
+# The main function orchestrates the execution of the different skyline algorithms.
+# With baseline=True it also runs the pairwise sequential scan, which compares every pair of points and is only
+# practical for small datasets
+def main(baseline=False):
     dataset_path = "city2.txt"  # Path to the input dataset
     output_path = "output_city2.txt"  # Path for the output file
 
-    # Read the dataset into a list of points
-    points_list = read_dataset(dataset_path)
+    # Read the dataset into arrays, and quantize the coordinates for the skyline searches
+    xs, ys, ids = read_dataset(dataset_path)
+    xs_q, ys_q = quantize(xs), quantize(ys)
+    # I sort the points by x once, for both the R-tree of the BBS search and the split of divide-and-conquer
+    x_order = np.argsort(xs_q, kind='stable')
 
     # Open the output file for writing the results
     with open(output_path, 'w') as output_file:
         # Perform the sequential scan and time it
-        start_time = time.time()
-        sequential_skyline = sequential_scan_skyline(points_list)
-        end_time = time.time()
-        # Write the results of the sequential scan to the output file
+        with timed() as timer:
+            sequential_skyline = sequential_scan_skyline_np(xs_q, ys_q)
+        # Write the results of the sequential scan to the output file, all the points in one write
         output_file.write("Sequential Scan Skyline Results:\n")
-        for point in sequential_skyline:
-            output_file.write(f"{point['id']} {point['x']} {point['y']}\n")
-        output_file.write(f"Sequential Scan Time: {end_time - start_time:.4f} seconds\n\n")
+        output_file.write(format_skyline(sequential_skyline, xs, ys, ids))
+        output_file.write(f"Sequential Scan Time: {timer['seconds']:.4f} seconds\n\n")
+
+        if baseline:
+            # Perform the pairwise sequential scan and time it
+            print("Sequential scan is O(N^2); expect several minutes above N=10^4")
+            with timed() as timer:
+                pairwise_skyline = sequential_scan_skyline(xs_q, ys_q)
+            # Write the results of the pairwise sequential scan to the output file
+            output_file.write("Pairwise Sequential Scan Skyline Results:\n")
+            output_file.write(format_skyline(pairwise_skyline, xs, ys, ids))
+            output_file.write(f"Pairwise Sequential Scan Time: {timer['seconds']:.4f} seconds\n\n")
 
         # Build an R-tree from the points and perform the BBS algorithm
-        rtree = create_rtree.main(points_list)
-        start_time = time.time()
-        bbs_skyline = bbs_skyline_search(rtree)
-        end_time = time.time()
+        rtree = create_rtree.main(xs_q, ys_q, x_order)
+        with timed() as timer:
+            bbs_skyline = bbs_skyline_search(rtree)
         # Write the results of the BBS algorithm to the output file
         output_file.write("BBS Skyline Results:\n")
-        for point in bbs_skyline:
-            output_file.write(f"{point['id']} {point['x']} {point['y']}\n")
-        output_file.write(f"BBS Execution Time: {end_time - start_time:.4f} seconds\n\n")
+        output_file.write(format_skyline(bbs_skyline, xs, ys, ids))
+        output_file.write(f"BBS Execution Time: {timer['seconds']:.4f} seconds\n\n")
 
         # Perform the BBS with divide-and-conquer and time it
-        start_time = time.time()
-        divide_conquer_skyline = bbs_divide_and_conquer(points_list)
-        end_time = time.time()
+        with timed() as timer:
+            divide_conquer_skyline = bbs_divide_and_conquer(xs_q, ys_q, x_order)
         # Write the results of the divide-and-conquer algorithm to the output file
         output_file.write("BBS with Divide-and-Conquer Skyline Results:\n")
-        for point in divide_conquer_skyline:
-            output_file.write(f"{point['id']} {point['x']} {point['y']}\n")
-        output_file.write(f"Divide-and-Conquer Execution Time: {end_time - start_time:.4f} seconds\n")
+        output_file.write(format_skyline(divide_conquer_skyline, xs, ys, ids))
+        output_file.write(f"Divide-and-Conquer Execution Time: {timer['seconds']:.4f} seconds\n")
 
 # I use this to make sure the main function runs when I execute the script
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Find the skyline of city2.txt with each algorithm")
+    parser.add_argument("--baseline", action="store_true",
+                        help="also run the pairwise O(N^2) sequential scan, as a baseline for the other algorithms")
+    main(baseline=parser.parse_args().baseline)
@@ -1,32 +1,72 @@
 # create_rtree.py
 import sys
 import math
+import numpy as np
+from numba import njit
 
 # The maximum number of entries a node can have before it needs to split
 B = 4
 
+# I calculate the perimeter of the MBR around the first i + 1 boxes, for every i, using running minimums and maximums.
+# Each row of boxes is [x1, y1, x2, y2]
+def prefix_perimeters(boxes):
+    low = np.minimum.accumulate(boxes[:, :2])
+    high = np.maximum.accumulate(boxes[:, 2:])
+    return (high - low).sum(axis=1)
+
+# I find the entry, among the first n rows [x1, y1, x2, y2] of boxes, whose perimeter would increase the least if the
+# point (px, py) were added to it, and return its position (the first one if there is a tie). This runs once per
+# level for every insertion, so I compile it, with the signature given up front so it is compiled on import
+@njit('i8(f8[:, :], i8, f8, f8)', cache=True)
+def least_perimeter_increase(boxes, n, px, py):
+    best = 0
+    min_increase = np.inf
+    for k in range(n):
+        x1, y1, x2, y2 = boxes[k, 0], boxes[k, 1], boxes[k, 2], boxes[k, 3]
+        increase = ((max(x2, px) - min(x1, px)) + (max(y2, py) - min(y1, py))) - ((x2 - x1) + (y2 - y1))
+        if increase < min_increase:
+            min_increase = increase
+            best = k
+    return best
+
 # This class represents a Node in my R-tree.
 class Node(object):
+    # I list the attributes up front, so each node has fixed slots instead of its own dictionary
+    __slots__ = ('id', 'child_nodes', 'data_points', 'parent', 'MBR', 'child_mbrs', 'n_children', '_perimeter', '_mindist')
+
     def __init__(self):
         # This is a unique ID for the node (not used in this example, but I could use it if needed)
         self.id = 0
         # These are child nodes, which are used when the node is not a leaf
         self.child_nodes = []
-        # These are data points for when the node is a leaf (the actual entries)
+        # These are data points for when the node is a leaf (the actual entries). In a bulk-loaded tree these are the
+        # positions of the points in the input arrays
         self.data_points = []
         # I keep track of the parent node so I can backtrack if needed
         self.parent = None
-        # This is the Minimum Bounding Rectangle (MBR) that defines the space this node covers
-        self.MBR = {
-            'x1': float('inf'),  # The leftmost x-coordinate (starts as infinity for initialization)
-            'y1': float('inf'),  # The bottommost y-coordinate (starts as infinity)
-            'x2': float('-inf'), # The rightmost x-coordinate (starts as negative infinity)
-            'y2': float('-inf')  # The topmost y-coordinate (starts as negative infinity)
-        }
+        # This is the Minimum Bounding Rectangle (MBR) that defines the space this node covers, as an array [x1, y1, x2, y2]
+        # (left, bottom, right, top). It starts empty: infinity for the minimums and negative infinity for the maximums
+        self.MBR = np.array([np.inf, np.inf, -np.inf, -np.inf])
+        # I keep the boxes of the node's entries as rows [x1, y1, x2, y2] of one array, with room for the B + 1 entries of an
+        # overflowing node. For a non-leaf node, row k is the MBR of child_nodes[k]; for a leaf, row k is data_points[k]
+        # as a box with no size, [x, y, x, y]. n_children is the number of rows in use
+        self.child_mbrs = np.empty((B + 2, 4))
+        self.n_children = 0
+        # I keep the perimeter of the MBR and its squared distance to the origin, which only change when the MBR does
+        self._perimeter = float('-inf')
+        self._mindist = float('inf')
 
     # Here, I calculate the perimeter of the node's MBR (I use this for finding optimal placement)
     def perimeter(self):
-        return (self.MBR['x2'] - self.MBR['x1']) + (self.MBR['y2'] - self.MBR['y1'])
+        return self._perimeter
+
+    # I set the MBR and recalculate the values that depend on it
+    def set_mbr(self, mbr):
+        self.MBR = mbr
+        x1, y1, x2, y2 = mbr.tolist()
+        self._perimeter = (x2 - x1) + (y2 - y1)
+        # The closest point of the MBR to the origin (0, 0) is its top-left corner (x1, y2); I keep the squared distance
+        self._mindist = x1 * x1 + y2 * y2
 
     # I check if the node has more entries than allowed (i.e., it's overflowing)
     def is_overflow(self):
@@ -49,96 +89,90 @@ class RTree(object):
         # The tree starts with an empty root node
         self.root = Node()
 
-    # I use this function to insert a new data point into the R-tree, starting from the given node (u)
+    # I use this function to insert a new data point into the R-tree, starting from the given node (u).
+    # I go down the tree in a loop rather than with recursive calls, and keep the nodes I pass in a path
     def insert(self, u, p):
-        if u.is_leaf():
-            # If the current node is a leaf, I can add the data point here
-            self.add_data_point(u, p)
-            # I check if adding the point caused an overflow (too many entries)
-            if u.is_overflow():
-                self.handle_overflow(u)  # If it's overflowing, I split the node
-        else:
+        path = []  # The nodes below u that I pass on the way down
+        while not u.is_leaf():
             # If it's not a leaf, I need to find the best subtree to insert the point
-            v = self.choose_subtree(u, p)
-            self.insert(v, p)  # I recursively insert into the chosen subtree
-            self.update_mbr(v)  # I update the MBR of the chosen subtree
+            u = self.choose_subtree(u, p)
+            path.append(u)
+        # Now the current node is a leaf, so I can add the data point here
+        self.add_data_point(u, p)
+        # I check if adding the point caused an overflow (too many entries)
+        if u.is_overflow():
+            self.handle_overflow(u)  # If it's overflowing, I split the node
+        # I update the MBRs of the nodes on the path, the deepest one first
+        for node in reversed(path):
+            self.update_mbr(node)
 
-    # Here, I find the best child node to insert the new point to minimize the perimeter increase
+    # Here, I find the best child node to insert the new point to minimize the perimeter increase.
+    # I check all the children in one compiled call over the rows of child_mbrs, instead of one child at a time in Python
     def choose_subtree(self, u, p):
-        min_increase = sys.maxsize  # I start with a very large number
-        best_child = None
-        for child in u.child_nodes:
-            # I calculate how much the perimeter would increase if I added the point to this child
-            increase = self.peri_increase(child, p)
-            if increase < min_increase:
-                min_increase = increase
-                best_child = child  # I keep track of the best child found so far
-        return best_child
-
-    # I use this to calculate how much the perimeter of a node's MBR would increase if I added a new point
-    def peri_increase(self, node, p):
-        origin_mbr = node.MBR
-        increase = (
-            (max(origin_mbr['x2'], p['x']) - min(origin_mbr['x1'], p['x'])) +
-            (max(origin_mbr['y2'], p['y']) - min(origin_mbr['y1'], p['y']))
-        ) - node.perimeter()
-        return increase
+        return u.child_nodes[least_perimeter_increase(u.child_mbrs, u.n_children, p['x'], p['y'])]
 
     # When a node overflows, I split it into two smaller nodes to handle the overflow
+    # I do this in a loop that moves up one level each time the parent overflows too
     def handle_overflow(self, u):
-        u1, u2 = self.split(u)  # I split the overflowing node into two
-        if u.is_root():
-            # If the node is the root, I create a new root and add the two new nodes as its children
-            new_root = Node()
-            self.add_child(new_root, u1)
-            self.add_child(new_root, u2)
-            self.root = new_root  # I update the root of the tree
-            self.update_mbr(new_root)
-        else:
+        while True:
+            u1, u2 = self.split(u)  # I split the overflowing node into two
+            if u.is_root():
+                # If the node is the root, I create a new root and add the two new nodes as its children
+                new_root = Node()
+                self.add_child(new_root, u1)
+                self.add_child(new_root, u2)
+                self.root = new_root  # I update the root of the tree
+                self.update_mbr(new_root)
+                return
             # If it's not the root, I replace the overflowing node with its split parts in its parent
             parent = u.parent
-            parent.child_nodes.remove(u)
+            self.remove_child(parent, u)
             self.add_child(parent, u1)
             self.add_child(parent, u2)
             # I check if the parent is now overflowing, and handle it if necessary
-            if parent.is_overflow():
-                self.handle_overflow(parent)
+            if not parent.is_overflow():
+                return
+            u = parent
 
     # This function splits a node into two smaller nodes when handling an overflow
     def split(self, u):
-        best_s1, best_s2 = Node(), Node()  # These will hold the best split I find
         best_perimeter = sys.maxsize  # I start with a very large perimeter sum
+        m = u.n_children
+        boxes = u.child_mbrs[:m]
         if u.is_leaf():
             # If the node is a leaf, I split its data points
-            m = len(u.data_points)
+            entries = u.data_points
             # I divide the data points based on x and y to find the best split
-            divides = [sorted(u.data_points, key=lambda dp: dp['x']),
-                       sorted(u.data_points, key=lambda dp: dp['y'])]
+            columns = (0, 1)
         else:
-            # If the node is not a leaf, I split its child nodes
-            m = len(u.child_nodes)
-            divides = [sorted(u.child_nodes, key=lambda cn: cn.MBR['x1']),
-                       sorted(u.child_nodes, key=lambda cn: cn.MBR['x2']),
-                       sorted(u.child_nodes, key=lambda cn: cn.MBR['y1']),
-                       sorted(u.child_nodes, key=lambda cn: cn.MBR['y2'])]
+            # If the node is not a leaf, I split its child nodes, based on each side of their MBRs
+            entries = u.child_nodes
+            columns = (0, 2, 1, 3)
 
         # I try each possible split and find the one with the smallest perimeter sum
-        for divide in divides:
-            for i in range(math.ceil(0.4 * B), m - math.ceil(0.4 * B) + 1):
-                s1 = Node()
-                s2 = Node()
-                if u.is_leaf():
-                    s1.data_points = divide[:i]
-                    s2.data_points = divide[i:]
-                else:
-                    s1.child_nodes = divide[:i]
-                    s2.child_nodes = divide[i:]
-                self.update_mbr(s1)
-                self.update_mbr(s2)
-                perimeter_sum = s1.perimeter() + s2.perimeter()
-                if perimeter_sum < best_perimeter:
-                    best_perimeter = perimeter_sum
-                    best_s1, best_s2 = s1, s2
+        k = math.ceil(0.4 * B)  # The smallest number of entries each of the two nodes can get
+        for column in columns:
+            # I sort the entries by one column of their boxes (a stable sort, like sorted())
+            order = np.argsort(boxes[:, column], kind='stable')
+            divide_boxes = boxes[order]
+            # prefix[i] is the perimeter of the first i + 1 entries, and suffix[i] that of the entries from i onwards,
+            # so I get the perimeter sum of every split without building trial nodes
+            prefix = prefix_perimeters(divide_boxes)
+            suffix = prefix_perimeters(divide_boxes[::-1])[::-1]
+            # The perimeter sum of splitting into divide[:i] and divide[i:], for i = k, ..., m - k
+            perimeter_sums = prefix[k - 1:m - k] + suffix[k:m - k + 1]
+            i = int(np.argmin(perimeter_sums))
+            if perimeter_sums[i] < best_perimeter:
+                best_perimeter = perimeter_sums[i]
+                best_order, best_i = order, i + k
+
+        # I build the two nodes of the best split
+        best_s1, best_s2 = Node(), Node()
+        divide = [entries[j] for j in best_order]
+        self.set_entries(best_s1, divide[:best_i], boxes[best_order[:best_i]], u.is_leaf())
+        self.set_entries(best_s2, divide[best_i:], boxes[best_order[best_i:]], u.is_leaf())
+        self.update_mbr(best_s1)
+        self.update_mbr(best_s2)
 
         # I set the parent references for the new child nodes
         for child in best_s1.child_nodes:
@@ -148,41 +182,103 @@ class RTree(object):
 
         return best_s1, best_s2
 
+    # I give a new node its entries (child nodes or data points) together with their boxes
+    def set_entries(self, node, entries, boxes, is_leaf):
+        if is_leaf:
+            node.data_points = entries
+        else:
+            node.child_nodes = entries
+        node.n_children = len(entries)
+        node.child_mbrs[:len(entries)] = boxes
+
     # I add a child node to a given node and update its MBR
     def add_child(self, node, child):
         node.child_nodes.append(child)
+        node.child_mbrs[node.n_children] = child.MBR
+        node.n_children += 1
         child.parent = node
         self.update_mbr(node)
 
+    # I remove a child node from a given node, together with its row of child_mbrs
+    def remove_child(self, node, child):
+        k = node.child_nodes.index(child)
+        del node.child_nodes[k]
+        node.child_mbrs[k:node.n_children - 1] = node.child_mbrs[k + 1:node.n_children]
+        node.n_children -= 1
+        child.parent = None  # The removed node no longer passes its MBR on to this node
+
     # I add a data point to a node and update its MBR
     def add_data_point(self, node, data_point):
         node.data_points.append(data_point)
+        node.child_mbrs[node.n_children] = (data_point['x'], data_point['y'], data_point['x'], data_point['y'])
+        node.n_children += 1
         self.update_mbr(node)
 
-    # I update the MBR of a node based on its child nodes or data points
+    # I update the MBR of a node from the boxes of its entries, and pass the new MBR on to the node's row in its parent
     def update_mbr(self, node):
-        x_list = []
-        y_list = []
-        if node.is_leaf():
-            # I collect x and y coordinates from the data points
-            x_list = [dp['x'] for dp in node.data_points]
-            y_list = [dp['y'] for dp in node.data_points]
-        else:
-            # I collect x and y coordinates from the MBRs of the child nodes
-            for child in node.child_nodes:
-                x_list.extend([child.MBR['x1'], child.MBR['x2']])
-                y_list.extend([child.MBR['y1'], child.MBR['y2']])
-        # I update the MBR of the node with the min and max coordinates
-        node.MBR = {
-            'x1': min(x_list),
-            'x2': max(x_list),
-            'y1': min(y_list),
-            'y2': max(y_list)
-        }
-
-# I create an R-tree from a list of points
-def main(points_list):
+        boxes = node.child_mbrs[:node.n_children]
+        # The MBR is the min of the lower bounds and the max of the upper bounds
+        node.MBR[:2] = np.minimum.reduce(boxes[:, :2])
+        node.MBR[2:] = np.maximum.reduce(boxes[:, 2:])
+        node.set_mbr(node.MBR)
+        if node.parent is not None:
+            node.parent.child_mbrs[node.parent.child_nodes.index(node)] = node.MBR
+
+# I put entries in Sort-Tile-Recursive (STR) order: I sort them by x, cut them into ceil(sqrt(n / capacity)) vertical
+# strips, and sort each strip by y. Taking consecutive groups of 'capacity' entries from this order gives compact nodes.
+# If the caller already has the entries sorted by x (a stable argsort of cx), it can pass them as x_order to skip that sort
+def str_order(cx, cy, capacity, x_order=None):
+    n = len(cx)
+    strips = math.ceil(math.sqrt(math.ceil(n / capacity)))
+    strip_size = math.ceil(math.ceil(n / capacity) / strips) * capacity  # A multiple of capacity, so no node spans two strips
+    order = np.argsort(cx, kind='stable') if x_order is None else np.array(x_order)
+    for start in range(0, n, strip_size):
+        strip = order[start:start + strip_size]
+        order[start:start + strip_size] = strip[np.argsort(cy[strip], kind='stable')]
+    return order
+
+# I build an R-tree from all the points at once with STR bulk loading, instead of inserting them one at a time.
+# The points are packed B at a time (the module's B, which every Node is made for) into leaves in STR order, and each
+# level above is built the same way from the centres of the MBRs of the level below, until only the root is left.
+# There is no overflow handling or splitting.
+# The points are given as two arrays, xs and ys, and each leaf stores the positions of its points in these arrays.
+# x_order can give the positions of the points sorted by x, if they are already known, for the first STR sort
+def bulk_load_str(xs, ys, x_order=None):
     rtree = RTree()
-    for point in points_list:
-        rtree.insert(rtree.root, point)
-    return rtree  # I return the constructed R-tree
+    if len(xs) == 0:
+        return rtree
+    # The boxes of the entries of the current level, one row [x1, y1, x2, y2] each (points are boxes with no size)
+    boxes = np.column_stack((xs, ys, xs, ys)).astype(np.float64)
+    entries = list(range(len(xs)))
+    is_leaf = True
+    while True:
+        order = str_order((boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2, B, x_order)
+        x_order = None  # The levels above are sorted from scratch
+        if is_leaf:
+            # Within each leaf, I sort the points by x ascending and y descending, so that the skyline search can
+            # skip the points that another point of the same leaf dominates (see bbs_skyline_search in Task2.py)
+            leaf_of = np.arange(len(order)) // B
+            order = order[np.lexsort((-boxes[order, 1], boxes[order, 0], leaf_of))]
+        boxes = boxes[order]
+        entries = [entries[k] for k in order]
+        # Each node of this level takes B consecutive entries (the last one may take fewer)
+        starts = np.arange(0, len(entries), B)
+        # The MBRs of all the new nodes in one pass: the min and max over each group of consecutive boxes
+        mbrs = np.hstack((np.minimum.reduceat(boxes[:, :2], starts), np.maximum.reduceat(boxes[:, 2:], starts)))
+        nodes = []
+        for start, mbr in zip(starts, mbrs):
+            node = Node()
+            rtree.set_entries(node, entries[start:start + B], boxes[start:start + B], is_leaf)
+            for child in node.child_nodes:
+                child.parent = node
+            node.set_mbr(mbr.copy())
+            nodes.append(node)
+        if len(nodes) == 1:
+            rtree.root = nodes[0]
+            return rtree
+        # The nodes I just built are the entries of the next level up
+        boxes, entries, is_leaf = mbrs, nodes, False
+
+# I create an R-tree from the x and y arrays of the points (x_order can give the points' positions sorted by x)
+def main(xs, ys, x_order=None):
+    return bulk_load_str(xs, ys, x_order=x_order)  # I return the constructed R-tree